@@ -12,10 +12,16 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain.chat_models import init_chat_model
 from langchain_community.utilities import SQLDatabase
 from typing_extensions import TypedDict, Annotated
+from sqlite_operations import SQLiteDB
 
 # Testing to get the AI to read and only use the DB for responses
 
-db = SQLDatabase.from_uri("sqlite:///C:/Users/Doing/University of Central Florida/UCF_Photovoltaics_GRP - module_databases/Complete_Dataset.db")
+DATABASE_PATH = "C:/Users/Doing/University of Central Florida/UCF_Photovoltaics_GRP - module_databases/Complete_Dataset.db"
+MAX_QUERY_ROWS = 100
+QUERY_TIME_LIMIT = 5.0 # Seconds before a generated query is interrupted
+
+db = SQLDatabase.from_uri(f"sqlite:///{DATABASE_PATH}")
+sqlite_db = SQLiteDB(DATABASE_PATH)
 
 llm = init_chat_model("llama3.2:3b", model_provider="ollama")
 
@@ -110,5 +116,15 @@ def write_query(state: State):
     result = structured_llm.invoke(prompt)
     return {"query": result["query"]}
 
-write_query({"question": "How many modules are there?"})
+def execute_query(state: State):
+    """Execute SQL query with a row cap and time budget, reusing cached results."""
+    records = sqlite_db.run_guarded_query(
+        state["query"], max_rows=MAX_QUERY_ROWS, time_limit=QUERY_TIME_LIMIT
+    )
+    if records is None:
+        return {"result": "Query was rejected, failed or exceeded its time budget."}
+    return {"result": records.to_string(index=False)}
+
+query = write_query({"question": "How many modules are there?"})
+execute_query(query)
 
@@ -11,6 +11,11 @@ import pandas as pd
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 
+from summary_operations import ModuleSummaryStore, find_el_pairs, find_module_column, quote_table
+from table_schemas import apply_table_dtypes, to_integer_dates
+
+INTEGER_DATE_TYPES = ("smallint", "integer", "bigint", "numeric")
+
 class PostgresDB:
     def __init__(self, username, password, host="34.73.180.136", port=5432, database="fsecdatabase"):
         self.username = username
@@ -19,11 +24,35 @@ class PostgresDB:
         self.port = port
         self.database = database
         self.engine = create_engine(f"postgresql://{username}:{password}@{host}:{port}/{database}")
+        self.module_summaries = ModuleSummaryStore(
+            self.engine,
+            summary_table="instrument_data.module_summary",
+            el_pair_table="instrument_data.module_el_pair",
+            metadata_table="instrument_data.module_metadata",
+            module_id_column="module_id",
+            isc_column="nameplate_isc",
+        )
+        self.date_types = {}
+        self.date_partitions = set()
 
     def handle_error(self, error, context):
         print(f"Error in {context}: {str(error)}")  # Replace with logger if needed
 
     def create_postgres_records_from_dataframe(self, table_name, dataframe, if_exists='replace'):
+        # pandas writes to the default schema, where the table may be partitioned by date
+        current = self.read_records_from_postgres("SELECT current_schema() AS schema")
+        schema = current["schema"].iloc[0] if current is not None and not current.empty else None
+        if schema is not None and self.is_partitioned(table_name, schema):
+            if if_exists == 'replace':
+                # pandas would drop the partitioned table with all its partitions
+                self.handle_error(
+                    ValueError(f"{table_name} is partitioned by date and cannot be replaced, append to it instead"),
+                    "inserting dataframe records",
+                )
+                return
+            if if_exists == 'append':
+                self.create_partitioned_records_from_dataframe(table_name, dataframe, schema)
+                return
         try:
             dataframe.to_sql(
                 name=table_name,
@@ -34,27 +63,337 @@ class PostgresDB:
             )
         except SQLAlchemyError as e:
             self.handle_error(e, "inserting dataframe records")
+            return
+        if if_exists == 'replace':
+            self.refresh_module_summaries(table_name)
+        else:
+            self.update_module_summaries(table_name, dataframe)
+
+    def update_module_summaries(self, table_name, dataframe):
+        try:
+            self.module_summaries.update(table_name, dataframe)
+        except Exception as e:
+            self.handle_error(e, "updating module summaries")
+
+    def refresh_module_summaries(self, table_name, module_ids=None):
+        """
+        Rebuild the per-module summaries of a measurement table, e.g. after a backfill.
+        Returns the number of modules summarized, or None if an error occurred.
+        """
+        try:
+            return self.module_summaries.refresh(table_name, module_ids)
+        except Exception as e:
+            self.handle_error(e, "refreshing module summaries")
+            return None
 
-    def read_records_from_postgres(self, query, params=None):
+    def read_records_from_postgres(self, query, params=None, table_name=None):
+        """
+        Return query results as a DataFrame, converting known columns to compact
+        dtypes (see table_schemas) when the table_name being read is given.
+        """
         try:
-            return pd.read_sql(query, self.engine, params=params)
+            records = pd.read_sql(query, self.engine, params=params)
+            return apply_table_dtypes(records, table_name) if table_name else records
         except SQLAlchemyError as e:
             self.handle_error(e, "fetching data with SQLAlchemy")
             return None
 
-    def fetch_data_by_date(self, table_name, start_date, end_date):
+    def get_date_type(self, table_name, date_column="date"):
+        """
+        Return the PostgreSQL type of a table's date column (e.g. 'integer' or 'date'), or None.
+        """
+        if (table_name, date_column) not in self.date_types:
+            query = """
+            SELECT format_type(a.atttypid, a.atttypmod) AS data_type FROM pg_attribute a
+            WHERE a.attrelid = to_regclass(%s) AND a.attname = %s AND NOT a.attisdropped;
+            """
+            data_type = self.read_records_from_postgres(query, (quote_table(table_name), date_column))
+            if data_type is None or data_type.empty:
+                return None
+            self.date_types[(table_name, date_column)] = data_type.iloc[0]["data_type"]
+        return self.date_types[(table_name, date_column)]
+
+    def format_date(self, value, data_type):
+        """
+        Convert a date to the format of a date column: YYYYMMDD integers for integer
+        columns, 'YYYY-MM-DD' for date and timestamp columns and 'YYYYMMDD' otherwise.
+        """
+        yyyymmdd = to_integer_dates(pd.Series([value])).iloc[0]
+        if pd.isna(yyyymmdd) or data_type is None:
+            return value
+        yyyymmdd = int(yyyymmdd)
+        if data_type.startswith(INTEGER_DATE_TYPES):
+            return yyyymmdd
+        if data_type.startswith(("date", "timestamp")):
+            return f"{yyyymmdd // 10000:04d}-{yyyymmdd // 100 % 100:02d}-{yyyymmdd % 100:02d}"
+        return str(yyyymmdd)
+
+    def fetch_data_by_date(self, table_name, start_date, end_date, columns=None):
+        """
+        Return the rows of a table with start_date <= date <= end_date.
+
+        The dates are converted to the format of the date column and sent as
+        literals, so PostgreSQL only scans the partitions of the range when the
+        table is partitioned by date. Selecting only the needed columns keeps
+        the transfer small.
+
+        Parameters:
+        table_name (str): Table name, optionally prefixed with its schema.
+        start_date: First date, as YYYYMMDD or a date.
+        end_date: Last date, as YYYYMMDD or a date.
+        columns (list): Columns to return, all columns if None.
+
+        Returns:
+        pd.DataFrame: DataFrame containing the query results.
+        """
+        data_type = self.get_date_type(table_name)
+        select = ', '.join(f'"{col}"' for col in columns) if columns else '*'
         query = f"""
-        SELECT * FROM {table_name} 
-        WHERE date BETWEEN %s AND %s;
+        SELECT {select} FROM {quote_table(table_name)}
+        WHERE "date" BETWEEN %s AND %s;
+        """
+        params = (self.format_date(start_date, data_type), self.format_date(end_date, data_type))
+        return self.read_records_from_postgres(query, params)
+
+    def is_partitioned(self, table_name, schema="instrument_data"):
+        query = """
+        SELECT 1 FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s;
+        """
+        partitioned = self.read_records_from_postgres(query, (schema, table_name))
+        return partitioned is not None and not partitioned.empty
+
+    def create_date_indexes(self, connection, table_name, columns, schema="instrument_data"):
+        """
+        Create a BRIN index on the date column, small and suited to rows loaded in
+        date order, and a B-tree index on module id and date for per-module lookups.
+        Indexes on a partitioned table are created on every partition.
+        """
+        table = quote_table(f"{schema}.{table_name}")
+        connection.execute(text(
+            f'CREATE INDEX IF NOT EXISTS "{table_name}_date_brin" ON {table} USING BRIN ("date")'
+        ))
+        module_column = find_module_column(columns)
+        if module_column is not None:
+            connection.execute(text(
+                f'CREATE INDEX IF NOT EXISTS "{table_name}_module_date" ON {table} ("{module_column}", "date")'
+            ))
+
+    def ensure_date_partitions(self, table_name, dates, schema="instrument_data"):
+        """
+        Create the monthly partitions needed to hold the given dates.
+
+        Parameters:
+        table_name (str): Name of the partitioned table.
+        dates (pd.Series): Dates about to be loaded.
+        schema (str): Schema of the table.
         """
-        return self.read_records_from_postgres(query, (start_date, end_date))
+        data_type = self.get_date_type(f"{schema}.{table_name}")
+        months = set((to_integer_dates(pd.Series(dates)).dropna() // 100).astype(int))
+        created = []
+        with self.engine.begin() as connection:
+            for month in sorted(months):
+                partition = f"{table_name}_p{month}"
+                if (schema, partition) in self.date_partitions:
+                    continue
+                next_month = month + 1 if month % 100 < 12 else (month // 100 + 1) * 100 + 1
+                start = self.format_date(month * 100 + 1, data_type)
+                end = self.format_date(next_month * 100 + 1, data_type)
+                connection.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {quote_table(f'{schema}.{partition}')} "
+                    f"PARTITION OF {quote_table(f'{schema}.{table_name}')} FOR VALUES FROM (:start) TO (:end)"
+                ), {"start": start, "end": end})
+                created.append((schema, partition))
+        # Only remember partitions once they are committed
+        self.date_partitions.update(created)
+
+    def create_partitioned_table(self, table_name, dataframe, schema="instrument_data"):
+        """
+        Create a table range partitioned by month on its date column, with a
+        default partition for rows without a valid date, and its indexes.
+
+        Parameters:
+        table_name (str): Name of the table.
+        dataframe (pd.DataFrame): Rows defining the columns, with the date
+            column already converted to YYYYMMDD integers.
+        schema (str): Schema of the table.
+        """
+        table = quote_table(f"{schema}.{table_name}")
+        create_sql = pd.io.sql.get_schema(dataframe.head(0), table_name, con=self.engine, schema=schema)
+        with self.engine.begin() as connection:
+            connection.execute(text(create_sql.strip() + ' PARTITION BY RANGE ("date")'))
+            connection.execute(text(
+                f'CREATE TABLE IF NOT EXISTS {quote_table(f"{schema}.{table_name}_default")} PARTITION OF {table} DEFAULT'
+            ))
+            self.create_date_indexes(connection, table_name, dataframe.columns, schema)
+
+    def get_unique_keys(self, connection, table):
+        """
+        Get the primary key, unique constraints and unique indexes of a table.
+
+        Returns:
+        list: (name, 'p', 'u' or None for a plain unique index, key columns, unsupported) tuples,
+            where unsupported marks expression and partial indexes.
+        """
+        query = text("""
+        SELECT COALESCE(con.conname, ic.relname) AS name, con.contype,
+            ARRAY(SELECT a.attname::text FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, n)
+                  JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                  WHERE k.n <= i.indnkeyatts ORDER BY k.n) AS columns,
+            0 = ANY(i.indkey::int2[]) OR i.indpred IS NOT NULL AS unsupported
+        FROM pg_index i
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        LEFT JOIN pg_constraint con ON con.conindid = i.indexrelid AND con.conrelid = i.indrelid
+            AND con.contype IN ('p', 'u')
+        WHERE i.indrelid = to_regclass(:table) AND i.indisunique
+        """)
+        return [tuple(row) for row in connection.execute(query, {"table": table})]
+
+    def get_table_grants(self, connection, table):
+        """
+        Get the privileges granted on a table to roles other than its owner.
+
+        Returns:
+        list: (grantee, privilege, grantable) tuples, with the grantee quoted or PUBLIC.
+        """
+        query = text("""
+        SELECT CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END,
+            a.privilege_type, a.is_grantable
+        FROM pg_class c, aclexplode(c.relacl) a
+        WHERE c.oid = to_regclass(:table) AND a.grantee <> c.relowner
+        """)
+        return [tuple(row) for row in connection.execute(query, {"table": table})]
+
+    def convert_to_partitioned_table(self, table_name, schema="instrument_data"):
+        """
+        Replace an existing table with a copy partitioned by month on its date column.
+
+        The copy, its partitions and indexes are built and swapped in one
+        transaction, so readers see either the old or the new table. The table
+        comment, column comments and grants are copied. Primary keys, unique
+        constraints and unique indexes are rebuilt with the date column added,
+        as PostgreSQL requires for partitioned tables; the conversion is refused
+        when they cannot be kept, e.g. for expression indexes or a primary key
+        on a table with rows without a date.
+
+        Parameters:
+        table_name (str): Name of the table.
+        schema (str): Schema of the table.
+        """
+        try:
+            table = quote_table(f"{schema}.{table_name}")
+            old_table = f"{table_name}_unpartitioned"
+            data_type = self.get_date_type(f"{schema}.{table_name}")
+            dates = self.read_records_from_postgres(f'SELECT DISTINCT "date" FROM {table}')
+            months = sorted(set((to_integer_dates(dates["date"]).dropna() // 100).astype(int)))
+            created = []
+            with self.engine.begin() as connection:
+                unique_keys = self.get_unique_keys(connection, table)
+                unsupported = [name for name, _, _, is_unsupported in unique_keys if is_unsupported]
+                if unsupported:
+                    raise ValueError(f"Unique expression or partial indexes cannot be partitioned: {unsupported}")
+                grants = self.get_table_grants(connection, table)
+                comment = connection.execute(
+                    text("SELECT obj_description(to_regclass(:table), 'pg_class')"), {"table": table}
+                ).scalar()
+
+                connection.execute(text(f'ALTER TABLE {table} RENAME TO "{old_table}"'))
+                connection.execute(text(
+                    f'CREATE TABLE {table} (LIKE {quote_table(f"{schema}.{old_table}")} '
+                    f'INCLUDING DEFAULTS INCLUDING COMMENTS) PARTITION BY RANGE ("date")'
+                ))
+                connection.execute(text(
+                    f'CREATE TABLE {quote_table(f"{schema}.{table_name}_default")} PARTITION OF {table} DEFAULT'
+                ))
+                for month in months:
+                    next_month = month + 1 if month % 100 < 12 else (month // 100 + 1) * 100 + 1
+                    connection.execute(text(
+                        f"CREATE TABLE {quote_table(f'{schema}.{table_name}_p{month}')} "
+                        f"PARTITION OF {table} FOR VALUES FROM (:start) TO (:end)"
+                    ), {"start": self.format_date(month * 100 + 1, data_type),
+                        "end": self.format_date(next_month * 100 + 1, data_type)})
+                    created.append((schema, f"{table_name}_p{month}"))
+                connection.execute(text(f'INSERT INTO {table} SELECT * FROM {quote_table(f"{schema}.{old_table}")}'))
+                connection.execute(text(f'DROP TABLE {quote_table(f"{schema}.{old_table}")}'))
+
+                # Rebuilt after the old table is dropped, which frees their names
+                for name, constraint_type, key_columns, _ in unique_keys:
+                    if "date" not in key_columns:
+                        key_columns = key_columns + ["date"]
+                    keys = ', '.join(f'"{col}"' for col in key_columns)
+                    if constraint_type is None:
+                        connection.execute(text(f'CREATE UNIQUE INDEX "{name}" ON {table} ({keys})'))
+                    else:
+                        key_type = "PRIMARY KEY" if constraint_type == "p" else "UNIQUE"
+                        connection.execute(text(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {key_type} ({keys})'))
+                for grantee, privilege, grantable in grants:
+                    connection.execute(text(
+                        f"GRANT {privilege} ON {table} TO {grantee}" + (" WITH GRANT OPTION" if grantable else "")
+                    ))
+                if comment is not None:
+                    connection.execute(text(f"COMMENT ON TABLE {table} IS :comment"), {"comment": comment})
+                columns = connection.execute(text(f"SELECT * FROM {table} WHERE 1 = 0")).keys()
+                self.create_date_indexes(connection, table_name, list(columns), schema)
+            self.date_partitions.update(created)
+        except Exception as e:
+            self.handle_error(e, f"converting {table_name} to a partitioned table")
+
+    def create_partitioned_records_from_dataframe(self, table_name, dataframe, schema="instrument_data"):
+        """
+        Append rows to a date partitioned table, creating the table and any
+        missing monthly partitions first. Existing unpartitioned tables must be
+        converted with convert_to_partitioned_table.
+
+        Only the date column is converted, to YYYYMMDD integers; measurements
+        are stored at full precision. Rows whose dates cannot be parsed are
+        rejected with the whole DataFrame rather than stored without a date.
+
+        Parameters:
+        table_name (str): Name of the table.
+        dataframe (pd.DataFrame): Rows to insert.
+        schema (str): Schema of the table.
+        """
+        try:
+            records = dataframe.copy()
+            dates = to_integer_dates(records["date"])
+            invalid = records.loc[dates.isna() & records["date"].notna(), "date"]
+            if not invalid.empty:
+                raise ValueError(
+                    f"{len(invalid)} rows have dates that are not valid YYYYMMDD dates, "
+                    f"e.g. {invalid.astype(str).unique()[:5].tolist()}"
+                )
+            records["date"] = dates
+            if not self.is_partitioned(table_name, schema):
+                self.create_partitioned_table(table_name, records, schema)
+            data_type = self.get_date_type(f"{schema}.{table_name}")
+            if data_type is not None and data_type.startswith(("date", "timestamp")):
+                records["date"] = pd.to_datetime(records["date"].astype("string"), format="%Y%m%d", errors="coerce")
+            elif data_type is not None and not data_type.startswith(INTEGER_DATE_TYPES):
+                records["date"] = records["date"].astype("string")
+            self.ensure_date_partitions(table_name, records["date"], schema)
+            records.to_sql(
+                name=table_name,
+                con=self.engine,
+                schema=schema,
+                if_exists='append',
+                index=False,
+                method='multi',
+                chunksize=10000
+            )
+        except Exception as e:
+            self.handle_error(e, "inserting partitioned dataframe records")
+            return
+        self.update_module_summaries(f"{schema}.{table_name}", records)
 
     def get_table_names_and_comments(self):
         query = """
         SELECT c.relname AS table_name, obj_description(c.oid) AS table_comment
         FROM pg_class c
         LEFT JOIN pg_namespace n ON n.oid = c.relnamespace
-        WHERE c.relkind = 'r' AND n.nspname NOT IN ('pg_catalog', 'information_schema');
+        WHERE c.relkind IN ('r', 'p') AND NOT c.relispartition
+        AND n.nspname NOT IN ('pg_catalog', 'information_schema');
         """
         return self.read_records_from_postgres(query)
 
@@ -90,20 +429,7 @@ class PostgresDB:
             el_df = el_df.sort_values(by=["date", "time"])  # Enforce sequential ordering
 
             # Step 3: Identify pairs for each date
-            tolerance = 0.05 * isc_value
-            pairs_by_date = {}
-    
-            grouped = el_df.groupby("date")
-            for date, group in grouped:
-                near_isc = group[group["current"].between(isc_value - tolerance, isc_value + tolerance)]
-                near_01isc = group[group["current"].between(0.1 * isc_value - tolerance, 0.1 * isc_value + tolerance)]
-    
-                if not near_isc.empty and not near_01isc.empty:
-                    # Use first match from each category to form a pair
-                    pairs_by_date[str(date)] = {
-                        "tenth_isc": near_01isc.iloc[0].to_dict(),
-                        "one_isc": near_isc.iloc[0].to_dict()
-                    }
+            pairs_by_date = find_el_pairs(el_df, isc_value)
     
             return pairs_by_date if pairs_by_date else {"message": "No matching EL pairs found."}
 
@@ -115,4 +441,4 @@ class PostgresDB:
 # Example usage:
 db = PostgresDB(username="dpv", password="sun")
 #db.create_postgres_records_from_dataframe("table_name", dataframe)
- 
\ No newline at end of file
+ 
\ No newline at end of file
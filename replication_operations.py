@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:12:05 2026
+
+SQLite to PostgreSQL replication module.
+
+Copies only the rows added to SQLite tables since the previous sync into
+PostgreSQL, tracking a high-water mark (rowid or date) per table.
+
+Author: Brent
+"""
+
+import argparse
+import io
+import os
+from contextlib import closing
+
+import pandas as pd
+from sqlalchemy import text
+
+from postgres_operations import PostgresDB
+from sqlite_operations import SQLiteDB
+from summary_operations import find_module_column
+
+ROWID_COLUMN = "sqlite_rowid"
+STATE_TABLE = "replication_state"
+
+
+def quote_identifier(name):
+    """Quote a table or column name for use in SQL."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def find_bytes_columns(dataframe):
+    """Columns holding BLOB values, such as the serialized arrays read by utils.deserialize_array."""
+    return [col for col in dataframe.select_dtypes(include="object")
+            if dataframe[col].map(lambda value: isinstance(value, (bytes, bytearray, memoryview))).any()]
+
+
+def postgres_column_type(declared_type):
+    """
+    Map a declared SQLite column type to a PostgreSQL type, following SQLite's type affinity rules.
+
+    Columns with NUMERIC affinity (e.g. the TIMESTAMP columns written by pandas)
+    may hold text, so they are replicated as TEXT.
+    """
+    declared_type = (declared_type or "").upper()
+    if "INT" in declared_type:
+        return "BIGINT"
+    if any(name in declared_type for name in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if "BLOB" in declared_type:
+        return "BYTEA"
+    if any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        return "DOUBLE PRECISION"
+    return "TEXT"
+
+
+def encode_bytes(value):
+    """Encode a BLOB value in the PostgreSQL BYTEA hex format for COPY."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\x" + bytes(value).hex()
+    return value
+
+
+class SQLiteToPostgresReplicator:
+    def __init__(self, sqlite_db, postgres_db, schema="instrument_data", chunk_size=50000):
+        """
+        Replicate SQLite tables into a PostgreSQL schema.
+
+        Parameters:
+        sqlite_db (SQLiteDB): Source database.
+        postgres_db (PostgresDB): Target database.
+        schema (str): PostgreSQL schema holding the replicated tables.
+        chunk_size (int): Number of rows streamed and loaded per transaction.
+        """
+        self.sqlite_db = sqlite_db
+        self.postgres_db = postgres_db
+        self.schema = schema
+        self.chunk_size = chunk_size
+        self.logger = sqlite_db.logger
+
+    def handle_error(self, error, context):
+        self.sqlite_db.handle_error(error, context)
+
+    def qualified_name(self, table_name):
+        return f"{quote_identifier(self.schema)}.{quote_identifier(table_name)}"
+
+    def ensure_state_table(self):
+        """
+        Create the table that stores the high-water mark of every replicated table.
+        """
+        with self.postgres_db.engine.begin() as connection:
+            connection.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {self.qualified_name(STATE_TABLE)} (
+                table_name TEXT PRIMARY KEY,
+                mark_column TEXT NOT NULL,
+                high_water_mark TEXT,
+                rows_replicated BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """))
+
+    def get_high_water_mark(self, table_name):
+        """
+        Get the last replicated rowid or date of a SQLite table.
+
+        Parameters:
+        table_name (str): Name of the SQLite table.
+
+        Returns:
+        str: High-water mark, or None if the table has not been replicated yet.
+        """
+        query = f"SELECT high_water_mark FROM {self.qualified_name(STATE_TABLE)} WHERE table_name = %s"
+        state = self.postgres_db.read_records_from_postgres(query, (table_name,))
+        if state is None or state.empty:
+            return None
+        return state.iloc[0]["high_water_mark"]
+
+    def set_high_water_mark(self, table_name, mark_column, value, connection=None, rows=0):
+        """
+        Record the high-water mark of a SQLite table.
+
+        Can be called directly to seed tables that were already exported in full,
+        so the first sync does not copy them again.
+
+        Parameters:
+        table_name (str): Name of the SQLite table.
+        mark_column (str): 'rowid' or the date column used as the mark.
+        value: Last replicated rowid or date. A missing value keeps the recorded mark.
+        connection (sqlalchemy.engine.Connection): Open transaction to record the mark in.
+        rows (int): Number of rows replicated since the previous mark.
+        """
+        sql = text(f"""
+        INSERT INTO {self.qualified_name(STATE_TABLE)} (table_name, mark_column, high_water_mark, rows_replicated)
+        VALUES (:table_name, :mark_column, :high_water_mark, :rows)
+        ON CONFLICT (table_name) DO UPDATE SET
+            mark_column = EXCLUDED.mark_column,
+            high_water_mark = COALESCE(EXCLUDED.high_water_mark, {self.qualified_name(STATE_TABLE)}.high_water_mark),
+            rows_replicated = {self.qualified_name(STATE_TABLE)}.rows_replicated + EXCLUDED.rows_replicated,
+            updated_at = now()
+        """)
+        params = {"table_name": table_name, "mark_column": mark_column,
+                  "high_water_mark": None if pd.isna(value) else str(value), "rows": int(rows)}
+        if connection is not None:
+            connection.execute(sql, params)
+        else:
+            self.ensure_state_table()
+            with self.postgres_db.engine.begin() as connection:
+                connection.execute(sql, params)
+
+    def seed_high_water_mark(self, table_name, mark_column="rowid"):
+        """
+        Mark every row currently in a SQLite table as replicated, without copying it.
+
+        Use once for tables that were already exported in full (e.g. with
+        PostgresDB.create_postgres_records_from_dataframe), so only rows added
+        afterwards are replicated.
+
+        Parameters:
+        table_name (str): Name of the SQLite table.
+        mark_column (str): 'rowid' or the date column used as the mark.
+
+        Returns:
+        The recorded high-water mark, or None if an error occurred.
+        """
+        try:
+            column = "rowid" if mark_column == "rowid" else quote_identifier(mark_column)
+            with closing(self.sqlite_db.connect_read_only()) as sqlite_connection:
+                mark = sqlite_connection.execute(f"SELECT MAX({column}) FROM {quote_identifier(table_name)}").fetchone()[0]
+            if mark is None:
+                raise ValueError(f"{table_name} has no rows to seed the high-water mark from.")
+            self.set_high_water_mark(table_name, mark_column, mark)
+            self.logger.info("Seeded high-water mark of %s at %s", table_name, mark)
+            return mark
+        except Exception as e:
+            self.handle_error(e, f"seeding high-water mark of {table_name}")
+            return None
+
+    def target_has_rows(self, target_table):
+        query = "SELECT to_regclass(%s) IS NOT NULL AS table_exists"
+        exists = self.postgres_db.read_records_from_postgres(query, (self.qualified_name(target_table),))
+        if exists is None or not exists.iloc[0]["table_exists"]:
+            return False
+        rows = self.postgres_db.read_records_from_postgres(f"SELECT 1 FROM {self.qualified_name(target_table)} LIMIT 1")
+        return rows is not None and not rows.empty
+
+    def get_column_types(self, sqlite_connection, table_name):
+        """
+        Get the PostgreSQL types of the columns of a SQLite table from their declared types.
+
+        TEXT and untyped columns holding BLOB values, as written by
+        SQLiteDB.blank_insert_to_database, are replicated as BYTEA.
+
+        Parameters:
+        sqlite_connection (sqlite3.Connection): Connection to the source database.
+        table_name (str): Name of the SQLite table.
+
+        Returns:
+        dict: Column names mapped to PostgreSQL types, with 'sqlite_rowid' as BIGINT.
+        """
+        table = quote_identifier(table_name)
+        column_types = {name: postgres_column_type(declared_type) for _, name, declared_type, *_
+                        in sqlite_connection.execute(f"PRAGMA table_info({table})")}
+        text_columns = [col for col, column_type in column_types.items() if column_type == "TEXT"]
+        if text_columns:
+            checks = ', '.join(f"MAX(typeof({quote_identifier(col)}) = 'blob')" for col in text_columns)
+            has_blobs = sqlite_connection.execute(f"SELECT {checks} FROM {table}").fetchone()
+            column_types.update({col: "BYTEA" for col, blob in zip(text_columns, has_blobs) if blob})
+        column_types[ROWID_COLUMN] = "BIGINT"
+        return column_types
+
+    def _prepare_target_table(self, connection, sqlite_connection, table_name, target_table, columns, key_columns):
+        """
+        Create the target table or add columns missing from it, and index the upsert key.
+        """
+        existing = connection.execute(text("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = :schema AND table_name = :table
+            """), {"schema": self.schema, "table": target_table}).scalars().all()
+        if any(col not in existing for col in columns):
+            # Scans the SQLite table for BLOB values, so only done when columns are created
+            column_types = self.get_column_types(sqlite_connection, table_name)
+        if not existing:
+            definitions = ', '.join(f"{quote_identifier(col)} {column_types.get(col, 'TEXT')}" for col in columns)
+            connection.execute(text(f"CREATE TABLE {self.qualified_name(target_table)} ({definitions})"))
+        else:
+            for column in columns:
+                if column not in existing:
+                    connection.execute(text(
+                        f"ALTER TABLE {self.qualified_name(target_table)} "
+                        f"ADD COLUMN {quote_identifier(column)} {column_types.get(column, 'TEXT')}"
+                    ))
+
+        keys = ', '.join(quote_identifier(col) for col in key_columns)
+        index_name = quote_identifier(f"{target_table}_replication_key")
+        connection.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {self.qualified_name(target_table)} ({keys})"
+        ))
+
+    def _upsert_chunk(self, connection, target_table, chunk, key_columns):
+        """
+        Bulk-load a chunk into a staging table with COPY and upsert it into the target table.
+        """
+        columns = ', '.join(quote_identifier(col) for col in chunk.columns)
+        keys = ', '.join(quote_identifier(col) for col in key_columns)
+        updates = ', '.join(
+            f"{quote_identifier(col)} = EXCLUDED.{quote_identifier(col)}"
+            for col in chunk.columns if col not in key_columns
+        )
+        conflict_action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+
+        connection.execute(text(
+            f"CREATE TEMP TABLE replication_staging (LIKE {self.qualified_name(target_table)} "
+            f"INCLUDING DEFAULTS) ON COMMIT DROP"
+        ))
+        buffer = io.StringIO()
+        bytes_columns = find_bytes_columns(chunk)
+        if bytes_columns:
+            chunk = chunk.copy()
+            for col in bytes_columns:
+                chunk[col] = chunk[col].map(encode_bytes)
+        chunk.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(f"COPY replication_staging ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        connection.execute(text(f"""
+        INSERT INTO {self.qualified_name(target_table)} ({columns})
+        SELECT DISTINCT ON ({keys}) {columns} FROM replication_staging
+        ON CONFLICT ({keys}) {conflict_action}
+        """))
+
+    def replicate_table(self, table_name, mark_column="rowid", key_columns=None, target_table=None):
+        """
+        Copy rows added to a SQLite table since the last sync into PostgreSQL.
+
+        With mark_column='rowid' the SQLite rowid is stored in a 'sqlite_rowid'
+        column and used as the upsert key. With a date column, rows from the last
+        replicated date onwards are read again and key_columns must identify a row,
+        so re-copied rows are updated instead of duplicated. Every chunk is loaded
+        and its high-water mark recorded in one transaction, so an interrupted
+        sync resumes where it stopped. The first sync refuses to run when the
+        target table already has rows, see seed_high_water_mark. Module summaries of the replicated modules
+        are rebuilt afterwards. Monthly partitions are created on demand when the
+        target table is partitioned by date (see PostgresDB.create_partitioned_table).
+
+        Parameters:
+        table_name (str): Name of the SQLite table.
+        mark_column (str): 'rowid' or the name of a date column.
+        key_columns (list): Columns that uniquely identify a row in the target table.
+        target_table (str): PostgreSQL table name, defaults to the SQLite name with underscores.
+
+        Returns:
+        int: Number of rows replicated, or None if an error occurred.
+        """
+        target_table = target_table or table_name.replace('-', '_')
+        replicated = 0
+        module_ids = set()
+        try:
+            if mark_column == "rowid":
+                key_columns = key_columns or [ROWID_COLUMN]
+            elif not key_columns:
+                raise ValueError("key_columns are required when replicating by date.")
+
+            partitioned = self.postgres_db.is_partitioned(target_table, self.schema)
+            if partitioned and "date" not in key_columns:
+                # Unique indexes of a partitioned table must include its partition key
+                key_columns = list(key_columns) + ["date"]
+
+            self.ensure_state_table()
+            mark = self.get_high_water_mark(table_name)
+            if mark is None and self.target_has_rows(target_table):
+                raise ValueError(
+                    f"{self.schema}.{target_table} already has rows but {table_name} has no replication state, "
+                    f"so every row would be copied again. Seed the high-water mark first "
+                    f"(--seed or seed_high_water_mark) or empty the target table."
+                )
+            if mark_column == "rowid":
+                sql = (f"SELECT rowid AS {ROWID_COLUMN}, * FROM {quote_identifier(table_name)} "
+                       f"WHERE rowid > ? ORDER BY rowid")
+                params = (int(mark or 0),)
+                mark_field = ROWID_COLUMN
+            else:
+                mark_field = mark_column
+                condition = f"WHERE {quote_identifier(mark_column)} >= ? " if mark is not None else ""
+                sql = (f"SELECT * FROM {quote_identifier(table_name)} "
+                       f"{condition}ORDER BY {quote_identifier(mark_column)}")
+                params = (mark,) if mark is not None else ()
+
+            with closing(self.sqlite_db.connect_read_only()) as sqlite_connection:
+                chunks = pd.read_sql_query(sql, sqlite_connection, params=params,
+                                           chunksize=self.chunk_size, dtype=object)
+                prepared = False
+                for chunk in chunks:
+                    if chunk.empty:
+                        continue # pandas yields one empty chunk when there are no new rows
+                    if partitioned:
+                        self.postgres_db.ensure_date_partitions(target_table, chunk["date"], self.schema)
+                    with self.postgres_db.engine.begin() as connection:
+                        if not prepared:
+                            self._prepare_target_table(connection, sqlite_connection, table_name, target_table,
+                                                       chunk.columns, key_columns)
+                            prepared = True
+                        self._upsert_chunk(connection, target_table, chunk, key_columns)
+                        self.set_high_water_mark(table_name, mark_column, chunk[mark_field].dropna().max(),
+                                                 connection=connection, rows=len(chunk))
+                    replicated += len(chunk)
+                    module_column = find_module_column(chunk.columns)
+                    if module_column is not None:
+                        module_ids.update(chunk[module_column].dropna().astype(str))
+
+            if module_ids:
+                # Upserted rows may replace earlier copies, so recount the affected modules
+                self.postgres_db.refresh_module_summaries(f"{self.schema}.{target_table}", sorted(module_ids))
+
+            self.logger.info("Replicated %s rows from %s to %s.%s", replicated, table_name, self.schema, target_table)
+            return replicated
+        except Exception as e:
+            self.handle_error(e, f"replicating table {table_name} after {replicated} rows")
+            return None
+
+    def replicate_tables(self, tables):
+        """
+        Replicate several SQLite tables.
+
+        Parameters:
+        tables (dict): Table names mapped to keyword arguments for replicate_table.
+
+        Returns:
+        dict: Number of rows replicated per table (None for failed tables).
+        """
+        return {table_name: self.replicate_table(table_name, **(options or {}))
+                for table_name, options in tables.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replicate new rows from SQLite tables into PostgreSQL.")
+    parser.add_argument("database_path", help="Path to the SQLite database file.")
+    parser.add_argument("tables", nargs="+", help="SQLite tables to replicate.")
+    parser.add_argument("--mark-column", default="rowid", help="'rowid' or a date column used as high-water mark.")
+    parser.add_argument("--key-columns", nargs="+", help="Columns identifying a row, required with a date mark.")
+    parser.add_argument("--seed", action="store_true",
+                        help="Mark the current rows as replicated without copying them, for tables already exported in full.")
+    parser.add_argument("--schema", default="instrument_data")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--username", default=os.getenv("PGUSER"))
+    parser.add_argument("--password", default=os.getenv("PGPASSWORD"))
+    parser.add_argument("--host", default=os.getenv("PGHOST"))
+    parser.add_argument("--port", type=int, default=os.getenv("PGPORT"))
+    parser.add_argument("--database", default=os.getenv("PGDATABASE"))
+    args = parser.parse_args()
+
+    connection_args = {key: value for key, value in
+                       {"host": args.host, "port": args.port, "database": args.database}.items()
+                       if value is not None}
+    replicator = SQLiteToPostgresReplicator(
+        SQLiteDB(args.database_path),
+        PostgresDB(args.username, args.password, **connection_args),
+        schema=args.schema,
+        chunk_size=args.chunk_size,
+    )
+    if args.seed:
+        for table_name in args.tables:
+            mark = replicator.seed_high_water_mark(table_name, args.mark_column)
+            print(f"{table_name}: {'failed' if mark is None else f'high-water mark seeded at {mark}'}")
+        return
+
+    options = {"mark_column": args.mark_column, "key_columns": args.key_columns}
+    for table_name, rows in replicator.replicate_tables({table: options for table in args.tables}).items():
+        print(f"{table_name}: {'failed' if rows is None else f'{rows} rows replicated'}")
+
+
+if __name__ == "__main__":
+    main()
+
+# Example usage:
+# python replication_operations.py "C:/.../Complete_Dataset.db" module-metadata el-metadata --username dpv --password sun --seed
+# python replication_operations.py "C:/.../Complete_Dataset.db" module-metadata el-metadata --username dpv --password sun
+# python replication_operations.py "C:/.../Complete_Dataset.db" sinton-iv-metadata --mark-column date --key-columns date time serial_number
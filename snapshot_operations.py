@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:40:22 2026
+
+Parquet snapshot cache module.
+
+Materializes SQLite and PostgreSQL tables to partitioned Parquet datasets so
+repeated analytical reads use a compact columnar copy instead of the database.
+
+Author: Brent
+"""
+
+import json
+import shutil
+import time
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from table_schemas import to_integer_dates
+
+DATE_PARTITION_COLUMN = "date_month"
+MANIFEST_FILE = "_snapshot.json" # Files starting with '_' are ignored by pyarrow datasets
+
+
+def date_months(series):
+    """
+    Convert dates to YYYYMM integers, 0 where the date could not be parsed.
+    """
+    return (to_integer_dates(series).fillna(0) // 100).astype("int32")
+
+
+class ParquetSnapshotCache:
+    def __init__(self, cache_directory, sqlite_db=None, postgres_db=None, schema="instrument_data"):
+        """
+        Cache database tables as partitioned Parquet snapshots.
+
+        Parameters:
+        cache_directory (str): Folder holding the snapshots.
+        sqlite_db (SQLiteDB): Source for source='sqlite' snapshots.
+        postgres_db (PostgresDB): Source for source='postgres' snapshots.
+        schema (str): PostgreSQL schema of the source tables.
+        """
+        self.cache_directory = Path(cache_directory)
+        self.sqlite_db = sqlite_db
+        self.postgres_db = postgres_db
+        self.schema = schema
+
+    def handle_error(self, error, context):
+        if self.sqlite_db is not None:
+            self.sqlite_db.handle_error(error, context)
+        else:
+            self.postgres_db.handle_error(error, context)
+
+    def snapshot_path(self, table_name, source="sqlite"):
+        return self.cache_directory / source / table_name
+
+    def load_manifest(self, table_name, source="sqlite"):
+        """
+        Load the description of a snapshot.
+
+        Returns:
+        dict: Snapshot manifest, or None if no snapshot exists.
+        """
+        manifest_path = self.snapshot_path(table_name, source) / MANIFEST_FILE
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+
+    def get_table_version(self, table_name, source="sqlite"):
+        """
+        Get a fingerprint of a source table that changes when rows are written to it.
+
+        SQLite has no per-table change counter, so the version of the whole
+        database file is used and any write to the database refreshes its snapshots.
+        PostgreSQL tables use their row count and the newest transaction id
+        that wrote a row (xmin), which changes on every insert, update and
+        replace. Partitioned tables are read through all their partitions.
+
+        Returns:
+        list: Database file version for SQLite, [row count, newest xmin] for PostgreSQL.
+        """
+        if source == "sqlite":
+            return list(self.sqlite_db.get_database_version())
+
+        query = f'SELECT COUNT(*), COALESCE(MAX(xmin::text::bigint), 0) FROM {self.schema}."{table_name}"'
+        version = self.postgres_db.read_records_from_postgres(query)
+        return version.iloc[0].astype(int).tolist() if version is not None and not version.empty else None
+
+    def read_source(self, table_name, source="sqlite"):
+        if source == "sqlite":
+            return self.sqlite_db.read_records(table_name, typed=True)
+        return self.postgres_db.read_records_from_postgres(
+            f'SELECT * FROM {self.schema}."{table_name}"', table_name=table_name
+        )
+
+    def materialize(self, table_name, source="sqlite", partition_cols=None):
+        """
+        Write a table to a Parquet dataset, replacing any previous snapshot.
+
+        By default tables with a date column are partitioned by month and other
+        tables are written unpartitioned. Pass e.g. partition_cols=["module-id"]
+        to partition by module instead.
+
+        Parameters:
+        table_name (str): Name of the source table.
+        source (str): 'sqlite' or 'postgres'.
+        partition_cols (list): Columns to partition by, overriding the default.
+
+        Returns:
+        int: Number of rows written, or None if an error occurred.
+        """
+        try:
+            table_version = self.get_table_version(table_name, source)
+            records = self.read_source(table_name, source)
+            if records is None:
+                raise ValueError(f"Could not read {table_name} from {source}")
+
+            if partition_cols is None:
+                partition_cols = [DATE_PARTITION_COLUMN] if "date" in records.columns else []
+            if DATE_PARTITION_COLUMN in partition_cols:
+                records[DATE_PARTITION_COLUMN] = date_months(records["date"])
+
+            for col in records.select_dtypes(include="object"):
+                values = records[col].dropna()
+                if col in partition_cols or (not values.empty and not isinstance(values.iloc[0], bytes)):
+                    # Mixed Python types cannot be stored in one Parquet column
+                    records[col] = records[col].where(records[col].isna(), records[col].astype(str))
+
+            path = self.snapshot_path(table_name, source)
+            staging = path.with_name(path.name + ".tmp")
+            shutil.rmtree(staging, ignore_errors=True)
+            staging.mkdir(parents=True)
+            pq.write_to_dataset(
+                pa.Table.from_pandas(records, preserve_index=False),
+                root_path=str(staging),
+                partition_cols=partition_cols or None,
+            )
+            with open(staging / MANIFEST_FILE, "w") as f:
+                json.dump({
+                    "table_name": table_name,
+                    "source": source,
+                    "partition_cols": partition_cols,
+                    "table_version": table_version,
+                    "rows": len(records),
+                    "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                }, f, indent=2)
+            shutil.rmtree(path, ignore_errors=True)
+            staging.rename(path)
+            return len(records)
+        except Exception as e:
+            self.handle_error(e, f"materializing snapshot of {table_name}")
+            return None
+
+    def is_stale(self, table_name, source="sqlite"):
+        """
+        Check whether the source table changed since its snapshot was written.
+        """
+        manifest = self.load_manifest(table_name, source)
+        if manifest is None:
+            return True
+        return manifest["table_version"] != self.get_table_version(table_name, source)
+
+    def refresh(self, table_name, source="sqlite", force=False):
+        """
+        Rebuild a snapshot if its source table changed.
+
+        Parameters:
+        table_name (str): Name of the source table.
+        source (str): 'sqlite' or 'postgres'.
+        force (bool): Rebuild even if the table appears unchanged.
+
+        Returns:
+        bool: True if the snapshot was rebuilt.
+        """
+        try:
+            if not force and not self.is_stale(table_name, source):
+                return False
+        except Exception as e:
+            self.handle_error(e, f"checking snapshot of {table_name}")
+            return False
+        manifest = self.load_manifest(table_name, source)
+        partition_cols = manifest["partition_cols"] if manifest else None
+        return self.materialize(table_name, source, partition_cols) is not None
+
+    def prune_filters(self, filters, partition_cols):
+        """
+        Add month partition filters matching any filters on the date column.
+        """
+        if not filters or not isinstance(filters, list) or DATE_PARTITION_COLUMN not in partition_cols:
+            return filters
+        nested = isinstance(filters[0], list)
+        pruned = []
+        for group in (filters if nested else [filters]):
+            extra = []
+            for column, op, value in group:
+                if column != "date":
+                    continue
+                if op in ("in", "not in"):
+                    months = set(date_months(pd.Series(list(value))))
+                    if op == "in" and 0 not in months:
+                        extra.append((DATE_PARTITION_COLUMN, "in", months))
+                    continue
+                month = int(date_months(pd.Series([value])).iloc[0])
+                if month == 0 or op == "!=":
+                    continue
+                month_op = {"=": "=", "==": "=", "<": "<=", "<=": "<=", ">": ">=", ">=": ">="}[op]
+                extra.append((DATE_PARTITION_COLUMN, month_op, month))
+            pruned.append(list(group) + extra)
+        return pruned if nested else pruned[0]
+
+    def read_snapshot(self, table_name, source="sqlite", columns=None, filters=None, refresh=True):
+        """
+        Read a table from its Parquet snapshot, refreshing it first if the source changed.
+
+        Filters use the pyarrow DNF format, e.g. [("date", ">=", 20250101)], and
+        are pushed down to skip partitions and row groups that cannot match.
+
+        Parameters:
+        table_name (str): Name of the source table.
+        source (str): 'sqlite' or 'postgres'.
+        columns (list): Columns to read, all columns if None.
+        filters (list): Row filters applied while reading.
+        refresh (bool): Check the source for changes before reading.
+
+        Returns:
+        pd.DataFrame: DataFrame containing the snapshot rows, or None if an error occurred.
+        """
+        try:
+            if refresh or self.load_manifest(table_name, source) is None:
+                self.refresh(table_name, source)
+            manifest = self.load_manifest(table_name, source)
+            partition_cols = manifest["partition_cols"]
+            partitioning = ds.partitioning(pa.schema([
+                (col, pa.int32() if col == DATE_PARTITION_COLUMN else pa.string()) for col in partition_cols
+            ]), flavor="hive") if partition_cols else None
+            table = pq.read_table(
+                str(self.snapshot_path(table_name, source)),
+                columns=columns,
+                filters=self.prune_filters(filters, partition_cols),
+                partitioning=partitioning,
+            )
+            return table.to_pandas()
+        except Exception as e:
+            self.handle_error(e, f"reading snapshot of {table_name}")
+            return None
+
+
+# Example usage:
+# cache = ParquetSnapshotCache("C:/.../snapshots", sqlite_db=SQLiteDB("C:/.../Complete_Dataset.db"))
+# cache.read_snapshot("el-metadata", columns=["module-id", "date", "current"], filters=[("date", ">=", 20250101)])
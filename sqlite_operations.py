@@ -8,12 +8,72 @@ Created on Wed Feb 19 17:51:57 2025
 import pandas as pd
 import sqlite3 as sq
 import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+from sqlalchemy import create_engine
+
+from summary_operations import ModuleSummaryStore
+from table_schemas import apply_table_dtypes, prepare_sqlite_records
+
+# Guarded query execution
+QUERY_CACHE_SIZE = 128
+QUERY_PROGRESS_STEPS = 10000 # SQLite VM instructions between time budget checks
+
+_SQL_TOKEN = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])|(--[^\n]*|/\*.*?\*/|\s+)""", re.S)
+
+
+def normalize_sql(query):
+    """
+    Normalize a SELECT statement so equivalent queries share a cache entry.
+
+    Comments are removed, whitespace is collapsed and everything outside of
+    quoted literals and identifiers is lowercased.
+
+    Parameters:
+    query (str): SQL query.
+
+    Returns:
+    str: Normalized SQL query.
+
+    Raises:
+    ValueError: If the query is not a single SELECT statement.
+    """
+    parts = []
+    statement_ends = 0
+    position = 0
+    for match in _SQL_TOKEN.finditer(query + ' '):
+        keyword = query[position:match.start()].lower()
+        if keyword:
+            statement_ends += keyword.count(';')
+            parts.append(keyword)
+        quoted = match.group(1)
+        if quoted:
+            parts.append(quoted)
+        elif parts and not parts[-1].endswith(' '):
+            parts.append(' ')
+        position = match.end()
+
+    sql = ''.join(parts).strip()
+    while sql.endswith(';'):
+        sql = sql[:-1].rstrip()
+        statement_ends -= 1
+    if statement_ends:
+        raise ValueError("Only a single SQL statement can be executed.")
+    if sql.split(' ', 1)[0] not in ('select', 'with'):
+        raise ValueError("Only SELECT statements can be executed.")
+    return sql
 
 
 class SQLiteDB:
     def __init__(self, database_path):
         self.database_path = database_path
         self.logger = self.create_logger()
+        self.query_cache = OrderedDict()
+        self.module_summaries = ModuleSummaryStore(create_engine(f"sqlite:///{database_path}"))
     
     def create_logger(self):
         """
@@ -48,7 +108,7 @@ class SQLiteDB:
         """
         self.logger.error("Error in %s: %s", context, str(error))
 
-    def read_records(self, table_name, select='*', conditions=None):
+    def read_records(self, table_name, select='*', conditions=None, typed=False):
         """
         Return the contents of a table as a DataFrame.
 
@@ -56,6 +116,7 @@ class SQLiteDB:
         table_name (str): Name of the SQL table.
         select (str): Columns to select.
         conditions (str): SQL conditions.
+        typed (bool): Convert known columns to compact dtypes (see table_schemas).
 
         Returns:
         pd.DataFrame: DataFrame containing the query results.
@@ -66,7 +127,8 @@ class SQLiteDB:
                 if conditions:
                     sql += f" {conditions}"
                 records = pd.read_sql_query(sql, connection)
-                return records.iloc[::-1].reset_index(drop=True) # Reverse
+                records = records.iloc[::-1].reset_index(drop=True) # Reverse
+                return apply_table_dtypes(records, table_name) if typed else records
         except Exception as e:
             self.handle_error(e, "reading records from table")
             return None
@@ -82,10 +144,30 @@ class SQLiteDB:
         try:
             with sq.connect(self.database_path) as connection:
                 dataframe.to_sql(table_name, connection, if_exists='append', index=False, dtype={col: 'TEXT' for col in dataframe})
-                
+            self.update_module_summaries(table_name, dataframe)
+
         except Exception as e:
             self.handle_error(e, "inserting data into table")
             pass
+
+    def typed_insert_to_database(self, table_name, dataframe):
+        """
+        Fallback function to save data to a table with INTEGER and REAL columns where the data allows.
+
+        Known date and measurement columns are stored as numbers, everything else as TEXT.
+
+        Parameters:
+        table_name (str): Name of the SQL table.
+        dataframe (pd.DataFrame): DataFrame containing data to insert.
+        """
+        try:
+            records, column_types = prepare_sqlite_records(dataframe, table_name)
+            with sq.connect(self.database_path) as connection:
+                records.to_sql(table_name, connection, if_exists='append', index=False, dtype=column_types)
+            self.update_module_summaries(table_name, records)
+
+        except Exception as e:
+            self.handle_error(e, "inserting typed data into table")
         
     def create_sqlite_record(self, table_name, columns, values):
         """
@@ -135,11 +217,44 @@ class SQLiteDB:
                     cursor.execute(sql)
                     connection.commit()
                 self.logger.info("Records inserted successfully into table %s", table_name)
+            self.update_module_summaries(table_name, dataframe)
             return f"{table_name} updated with {len(dataframe)} entries."
         except Exception as e:
             self.handle_error(e, "creating SQLite records from dataframe")
             return str(e)
 
+    def update_module_summaries(self, table_name, dataframe):
+        """
+        Add rows inserted into a measurement table to the per-module summary tables.
+
+        Parameters:
+        table_name (str): Name of the SQL table the rows were inserted into.
+        dataframe (pd.DataFrame): Inserted rows.
+        """
+        try:
+            self.module_summaries.update(table_name, dataframe)
+        except Exception as e:
+            self.handle_error(e, "updating module summaries")
+
+    def refresh_module_summaries(self, table_name, module_ids=None):
+        """
+        Rebuild the per-module summaries of a measurement table, e.g. after a backfill.
+
+        Parameters:
+        table_name (str): Name of the SQL table.
+        module_ids (list): Only rebuild these modules, all modules if None.
+
+        Returns:
+        int: Number of modules summarized, or None if an error occurred.
+        """
+        try:
+            modules = self.module_summaries.refresh(table_name, module_ids)
+            self.logger.info("Module summaries of %s rebuilt for %s modules", table_name, modules)
+            return modules
+        except Exception as e:
+            self.handle_error(e, "refreshing module summaries")
+            return None
+
     def join_module_metadata(self, dataframe):
         """
         Join the Make and Model from module metadata, reducing human error and maintaining consistency.
@@ -166,6 +281,75 @@ class SQLiteDB:
             self.handle_error(e, "joining module metadata")
             return dataframe
 
+    def connect_read_only(self):
+        """
+        Open a read-only connection to the database file.
+
+        Returns:
+        sqlite3.Connection: Connection that rejects any write to the database.
+        """
+        uri = Path(self.database_path).resolve().as_uri() + "?mode=ro"
+        return sq.connect(uri, uri=True)
+
+    def get_database_version(self):
+        """
+        Identify the current state of the database file, including any pending WAL changes.
+
+        Returns:
+        tuple: Modification time (ns) and size of the database and WAL files.
+        """
+        version = ()
+        for path in (self.database_path, self.database_path + "-wal"):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                version += (stat.st_mtime_ns, stat.st_size)
+        return version
+
+    def run_guarded_query(self, query, max_rows=1000, time_limit=5.0, use_cache=True):
+        """
+        Run a generated SELECT statement on a read-only connection with a row cap and time budget.
+
+        Results are cached by normalized SQL and database version, so repeated
+        queries return without touching the database until it changes.
+
+        Parameters:
+        query (str): SQL SELECT statement, e.g. from langchain_local.write_query.
+        max_rows (int): Maximum number of rows returned, enforced with an outer LIMIT.
+        time_limit (float): Seconds the query may run before it is interrupted.
+        use_cache (bool): Read and store results in the query cache.
+
+        Returns:
+        pd.DataFrame: Query results, or None if the query was rejected, failed or timed out.
+        """
+        try:
+            sql = normalize_sql(query)
+            cache_key = (sql, int(max_rows), self.get_database_version())
+            if use_cache and cache_key in self.query_cache:
+                self.query_cache.move_to_end(cache_key)
+                return self.query_cache[cache_key].copy()
+
+            deadline = time.monotonic() + time_limit
+            with closing(self.connect_read_only()) as connection:
+                connection.set_progress_handler(lambda: time.monotonic() > deadline, QUERY_PROGRESS_STEPS)
+                # Executed directly, as pd.read_sql_query wraps the interrupt in a DatabaseError
+                cursor = connection.execute(f"SELECT * FROM ({sql}) LIMIT {int(max_rows)}")
+                records = pd.DataFrame(cursor.fetchall(), columns=[col[0] for col in cursor.description])
+
+            if use_cache:
+                self.query_cache[cache_key] = records.copy()
+                if len(self.query_cache) > QUERY_CACHE_SIZE:
+                    self.query_cache.popitem(last=False)
+            return records
+        except sq.OperationalError as e:
+            if "interrupted" in str(e):
+                self.logger.warning("Query exceeded time budget of %s s: %s", time_limit, query)
+            else:
+                self.handle_error(e, "running guarded query")
+            return None
+        except Exception as e:
+            self.handle_error(e, "running guarded query")
+            return None
+
     def get_last_date_from_table(self, table_name='sinton-iv-metadata'):
         """
         Get the last date of a measurement for a table in the database.
@@ -190,4 +374,4 @@ class SQLiteDB:
                 return pd.read_sql_query(query, conn)
 # Example usage:
 # db = SQLiteDB("C:/Users/Doing/University of Central Florida/UCF_Photovoltaics_GRP - module_databases/Complete_Dataset.db")
-# db.read_records("module-metadata")
\ No newline at end of file
+# db.read_records("module-metadata")
\ No newline at end of file
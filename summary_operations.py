@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:31:10 2026
+
+Module summary operations module.
+
+Maintains per-module summary tables (measurement counts, first and last date,
+latest record and latest EL pair per measurement table) in either the SQLite
+or the PostgreSQL database. Rows are added incrementally from the bulk insert
+paths of SQLiteDB and PostgresDB, and refresh() rebuilds them after backfills.
+
+Author: Brent
+"""
+
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from table_schemas import to_integer_dates
+
+MODULE_COLUMNS = ("module-id", "module_id")
+EL_TABLES = ("el-metadata", "el_metadata")
+
+
+def quote_table(table_name):
+    """Quote a table name that may be prefixed with its schema."""
+    return '.'.join('"' + part.replace('"', '""') + '"' for part in str(table_name).split('.'))
+
+
+def base_name(table_name):
+    """Table name without its schema, as stored in the 'table-name' column."""
+    return str(table_name).split('.')[-1]
+
+
+def is_el_table(table_name):
+    return base_name(table_name) in EL_TABLES
+
+
+def find_module_column(columns):
+    return next((col for col in MODULE_COLUMNS if col in columns), None)
+
+
+def find_el_pairs(el_df, isc_value):
+    """
+    Identify the EL measurement pair (near 0.1 Isc and near Isc) of every date.
+
+    Parameters:
+    el_df (pd.DataFrame): EL measurements with float 'current' and 'date' columns, in measurement order.
+    isc_value (float): Nameplate short circuit current of the module.
+
+    Returns:
+    dict: Dates mapped to {'tenth_isc': record, 'one_isc': record}.
+    """
+    tolerance = 0.05 * isc_value
+    pairs_by_date = {}
+
+    grouped = el_df.groupby("date")
+    for date, group in grouped:
+        near_isc = group[group["current"].between(isc_value - tolerance, isc_value + tolerance)]
+        near_01isc = group[group["current"].between(0.1 * isc_value - tolerance, 0.1 * isc_value + tolerance)]
+
+        if not near_isc.empty and not near_01isc.empty:
+            # Use first match from each category to form a pair
+            pairs_by_date[str(date)] = {
+                "tenth_isc": near_01isc.iloc[0].to_dict(),
+                "one_isc": near_isc.iloc[0].to_dict()
+            }
+    return pairs_by_date
+
+
+def record_payload(row):
+    """Serialize a measurement row to JSON, leaving out BLOB values such as serialized arrays."""
+    return row[[not isinstance(value, (bytes, bytearray, memoryview)) for value in row]].to_json(date_format="iso")
+
+
+def summarize_measurements(table_name, dataframe):
+    """
+    Aggregate measurement rows per module, keeping the latest row of each module as JSON.
+
+    Parameters:
+    table_name (str): Name of the measurement table the rows belong to.
+    dataframe (pd.DataFrame): Measurement rows with a module id and 'date' column.
+
+    Returns:
+    pd.DataFrame: One row per module with the summary table columns.
+    """
+    module_column = find_module_column(dataframe.columns)
+    if module_column is None or "date" not in dataframe.columns:
+        return pd.DataFrame()
+
+    dataframe = dataframe.reset_index(drop=True)
+    records = pd.DataFrame({
+        "module-id": dataframe[module_column].astype(object),
+        "date": to_integer_dates(dataframe["date"]),
+        "time": dataframe["time"].astype(str) if "time" in dataframe.columns else None,
+    }).dropna(subset=["module-id"])
+    records["module-id"] = records["module-id"].astype(str)
+
+    dated = records.dropna(subset=["date"]).sort_values(["date", "time"])
+    latest = dated.groupby("module-id").tail(1).rename_axis("row").reset_index().set_index("module-id")
+    summary = pd.DataFrame({
+        "measurement-count": records.groupby("module-id").size(),
+        "first-date": dated.groupby("module-id")["date"].min(),
+        "last-date": latest["date"],
+        "last-time": latest["time"],
+        "last-record": latest["row"].map(lambda row: record_payload(dataframe.loc[row])),
+    }).reset_index()
+    summary.insert(1, "table-name", base_name(table_name))
+    return summary
+
+
+def latest_el_pairs(table_name, el_df, isc_values):
+    """
+    Find the most recent EL pair of every module in a set of EL measurements.
+
+    Parameters:
+    table_name (str): Name of the EL table the rows belong to.
+    el_df (pd.DataFrame): EL measurements.
+    isc_values (dict): Module ids mapped to their nameplate Isc.
+
+    Returns:
+    pd.DataFrame: One row per module that has a pair, with the EL pair table columns.
+    """
+    module_column = find_module_column(el_df.columns)
+    pairs = []
+    if module_column is None or el_df.empty:
+        return pd.DataFrame(pairs)
+
+    el_df = el_df.assign(
+        current=pd.to_numeric(el_df["current"], errors="coerce"),
+        date=to_integer_dates(el_df["date"]),
+    )
+    el_df = el_df.sort_values([col for col in ("date", "time") if col in el_df.columns])
+    for module_id, group in el_df.groupby(el_df[module_column].astype(str)):
+        isc_value = isc_values.get(module_id)
+        if isc_value is None or pd.isna(isc_value):
+            continue
+        pairs_by_date = find_el_pairs(group, float(isc_value))
+        if pairs_by_date:
+            date = max(pairs_by_date, key=int)
+            pairs.append({
+                "module-id": module_id,
+                "table-name": base_name(table_name),
+                "date": int(date),
+                "tenth-isc-record": record_payload(pd.Series(pairs_by_date[date]["tenth_isc"])),
+                "one-isc-record": record_payload(pd.Series(pairs_by_date[date]["one_isc"])),
+            })
+    return pd.DataFrame(pairs)
+
+
+def to_params(dataframe):
+    """Convert summary rows to bind parameters, with '-' replaced by '_' in the names."""
+    records = dataframe.astype(object).where(dataframe.notna(), None)
+    return [{key.replace('-', '_'): value.item() if hasattr(value, "item") else value
+             for key, value in row.items()}
+            for row in records.to_dict("records")]
+
+
+class ModuleSummaryStore:
+    def __init__(self, engine, summary_table="module-summary", el_pair_table="module-el-pair",
+                 metadata_table="module-metadata", module_id_column="module-id", isc_column="nameplate-isc"):
+        """
+        Per-module summary tables kept in the database behind an SQLAlchemy engine.
+
+        Parameters:
+        engine (sqlalchemy.engine.Engine): SQLite or PostgreSQL engine.
+        summary_table (str): Table with one row per module and measurement table.
+        el_pair_table (str): Table with the latest EL pair per module and EL table.
+        metadata_table (str): Module metadata table holding the nameplate Isc.
+        module_id_column (str): Module id column of the metadata table.
+        isc_column (str): Nameplate Isc column of the metadata table.
+        """
+        self.engine = engine
+        self.summary_table = quote_table(summary_table)
+        self.el_pair_table = quote_table(el_pair_table)
+        self.metadata_table = quote_table(metadata_table)
+        self.module_id_column = module_id_column
+        self.isc_column = isc_column
+
+    def ensure_tables(self, connection):
+        connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {self.summary_table} (
+            "module-id" TEXT NOT NULL,
+            "table-name" TEXT NOT NULL,
+            "measurement-count" BIGINT NOT NULL,
+            "first-date" INTEGER,
+            "last-date" INTEGER,
+            "last-time" TEXT,
+            "last-record" TEXT,
+            PRIMARY KEY ("module-id", "table-name")
+        )
+        """))
+        columns = connection.execute(text(f"SELECT * FROM {self.summary_table} WHERE 1 = 0")).keys()
+        if "last-record" not in columns:
+            # Summary tables created before the latest record was stored
+            connection.execute(text(f'ALTER TABLE {self.summary_table} ADD COLUMN "last-record" TEXT'))
+        connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {self.el_pair_table} (
+            "module-id" TEXT NOT NULL,
+            "table-name" TEXT NOT NULL,
+            "date" INTEGER,
+            "tenth-isc-record" TEXT,
+            "one-isc-record" TEXT,
+            PRIMARY KEY ("module-id", "table-name")
+        )
+        """))
+
+    def upsert_summaries(self, connection, summary):
+        """
+        Add summary rows to the existing ones: counts are summed, the first date
+        is the earliest and the last date/time and record the latest of both.
+        """
+        newer = ('summary."last-date" IS NULL OR excluded."last-date" > summary."last-date" OR '
+                 '(excluded."last-date" = summary."last-date" AND '
+                 'COALESCE(excluded."last-time", \'\') >= COALESCE(summary."last-time", \'\'))')
+        connection.execute(text(f"""
+        INSERT INTO {self.summary_table} AS summary
+            ("module-id", "table-name", "measurement-count", "first-date", "last-date", "last-time", "last-record")
+        VALUES (:module_id, :table_name, :measurement_count, :first_date, :last_date, :last_time, :last_record)
+        ON CONFLICT ("module-id", "table-name") DO UPDATE SET
+            "measurement-count" = summary."measurement-count" + excluded."measurement-count",
+            "first-date" = CASE WHEN summary."first-date" IS NULL OR excluded."first-date" < summary."first-date"
+                THEN excluded."first-date" ELSE summary."first-date" END,
+            "last-time" = CASE WHEN {newer} THEN excluded."last-time" ELSE summary."last-time" END,
+            "last-record" = CASE WHEN {newer} THEN excluded."last-record" ELSE summary."last-record" END,
+            "last-date" = CASE WHEN {newer} THEN excluded."last-date" ELSE summary."last-date" END
+        """), to_params(summary))
+
+    def upsert_el_pairs(self, connection, pairs):
+        """
+        Store EL pairs that are at least as recent as the stored pair of their module.
+        """
+        if pairs.empty:
+            return
+        connection.execute(text(f"""
+        INSERT INTO {self.el_pair_table} AS pair
+            ("module-id", "table-name", "date", "tenth-isc-record", "one-isc-record")
+        VALUES (:module_id, :table_name, :date, :tenth_isc_record, :one_isc_record)
+        ON CONFLICT ("module-id", "table-name") DO UPDATE SET
+            "date" = excluded."date",
+            "tenth-isc-record" = excluded."tenth-isc-record",
+            "one-isc-record" = excluded."one-isc-record"
+        WHERE pair."date" IS NULL OR excluded."date" >= pair."date"
+        """), to_params(pairs))
+
+    def read_rows(self, connection, sql, params=None):
+        result = connection.execute(sql, params or {})
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+    def get_isc_values(self, connection, module_ids):
+        sql = text(
+            f'SELECT "{self.module_id_column}", "{self.isc_column}" FROM {self.metadata_table} '
+            f'WHERE "{self.module_id_column}" IN :module_ids'
+        ).bindparams(bindparam("module_ids", expanding=True))
+        metadata = self.read_rows(connection, sql, {"module_ids": list(module_ids)})
+        isc_values = pd.to_numeric(metadata[self.isc_column], errors="coerce")
+        return dict(zip(metadata[self.module_id_column].astype(str), isc_values))
+
+    def update(self, table_name, dataframe):
+        """
+        Add rows just inserted into a measurement table to the summaries.
+
+        The latest EL pair is recomputed only for the modules and dates in the
+        new rows, reading the other measurements of those dates from the table.
+        It is stored in a separate transaction after the summary rows, so the
+        counts are kept if the EL pairs cannot be updated.
+
+        Parameters:
+        table_name (str): Name of the measurement table.
+        dataframe (pd.DataFrame): Inserted rows.
+
+        Returns:
+        int: Number of modules updated.
+        """
+        summary = summarize_measurements(table_name, dataframe)
+        if summary.empty:
+            return 0
+        with self.engine.begin() as connection:
+            self.ensure_tables(connection)
+            self.upsert_summaries(connection, summary)
+
+        dates = pd.Series(dataframe["date"].dropna().unique()).tolist()
+        if is_el_table(table_name) and dates:
+            with self.engine.begin() as connection:
+                module_column = find_module_column(dataframe.columns)
+                module_ids = summary["module-id"].tolist()
+                sql = text(
+                    f'SELECT * FROM {quote_table(table_name)} '
+                    f'WHERE "{module_column}" IN :module_ids AND "date" IN :dates'
+                ).bindparams(bindparam("module_ids", expanding=True), bindparam("dates", expanding=True))
+                el_df = self.read_rows(connection, sql, {"module_ids": module_ids, "dates": dates})
+                isc_values = self.get_isc_values(connection, module_ids)
+                self.upsert_el_pairs(connection, latest_el_pairs(table_name, el_df, isc_values))
+        return len(summary)
+
+    def refresh(self, table_name, module_ids=None):
+        """
+        Rebuild the summaries of a measurement table from its full contents.
+        EL pairs are rebuilt in a second transaction, as in update().
+
+        Parameters:
+        table_name (str): Name of the measurement table.
+        module_ids (list): Only rebuild these modules, all modules if None.
+
+        Returns:
+        int: Number of modules summarized.
+        """
+        with self.engine.begin() as connection:
+            self.ensure_tables(connection)
+            columns = list(connection.execute(text(f"SELECT * FROM {quote_table(table_name)} WHERE 1 = 0")).keys())
+            module_column = find_module_column(columns)
+            if module_column is None or "date" not in columns:
+                return 0 # Not a measurement table
+
+            sql = f"SELECT * FROM {quote_table(table_name)}"
+            delete_condition = '"table-name" = :table_name'
+            read_params = {}
+            if module_ids is not None:
+                sql += f' WHERE "{module_column}" IN :module_ids'
+                delete_condition += ' AND "module-id" IN :module_ids'
+                read_params["module_ids"] = [str(module_id) for module_id in module_ids]
+            delete_params = dict(read_params, table_name=base_name(table_name))
+
+            def statement(sql):
+                sql = text(sql)
+                return sql.bindparams(bindparam("module_ids", expanding=True)) if module_ids is not None else sql
+
+            records = self.read_rows(connection, statement(sql), read_params)
+            connection.execute(statement(f"DELETE FROM {self.summary_table} WHERE {delete_condition}"), delete_params)
+            summary = summarize_measurements(table_name, records)
+            if not summary.empty:
+                self.upsert_summaries(connection, summary)
+
+        if is_el_table(table_name):
+            with self.engine.begin() as connection:
+                connection.execute(statement(f"DELETE FROM {self.el_pair_table} WHERE {delete_condition}"), delete_params)
+                if not summary.empty:
+                    isc_values = self.get_isc_values(connection, summary["module-id"].tolist())
+                    self.upsert_el_pairs(connection, latest_el_pairs(table_name, records, isc_values))
+        return len(summary)
+
+
+# Example usage:
+# summaries = ModuleSummaryStore(create_engine("sqlite:///C:/.../Complete_Dataset.db"))
+# summaries.refresh("el-metadata")
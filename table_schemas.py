@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:05:48 2026
+
+Table schema module.
+
+Compact pandas dtypes for the columns of the known SQLite and PostgreSQL
+tables. Column and table names are matched with hyphens and underscores
+treated alike, so 'module_id' in PostgreSQL uses the 'module-id' mapping.
+
+Author: Brent
+"""
+
+import pandas as pd
+
+DATE = "date" # YYYYMMDD integers
+
+# Columns shared by the measurement metadata tables (see utils.get_filename_metadata)
+COLUMN_DTYPES = {
+    "date": DATE,
+    "module-id": "category",
+    "serial-number": "category",
+    "make": "category",
+    "model": "category",
+    "comment": "category",
+    "image-type": "category",
+    "measurement-number": "Int32",
+    "cell-number": "Int16",
+    "exposure-time": "float32",
+    "current": "float32",
+    "voltage": "float32",
+    "delay-time-(s)": "float32",
+    "setpoint-total-time-(s)": "float32",
+}
+
+TABLE_DTYPES = {
+    "module-metadata": {
+        # One row per module, so ids are not repeated
+        "module-id": None,
+        "serial-number": None,
+        "nameplate-pmp": "float64",
+        "nameplate-vmp": "float64",
+        "nameplate-imp": "float64",
+        "nameplate-voc": "float64",
+        "nameplate-isc": "float64",
+        "temperature-coefficient-voltage": "float64",
+        "temperature-coefficient-power": "float64",
+        "temperature-coefficient-current": "float64",
+        "module-packaging": "category",
+        "interconnection-scheme": "category",
+        "number-parallel-strings": "Int16",
+        "cells-per-string": "Int16",
+        "module-arc": "category",
+        "connector-type": "category",
+        "junction-box-locations": "category",
+        "number-junction-box": "Int16",
+        "cell-technology": "category",
+        "wafer-doping-polarity": "category",
+        "wafer-crystallinity": "category",
+        "encapsulant": "category",
+        "backsheet": "category",
+        "frame-material": "category",
+        "x": "Int32",
+        "y": "Int32",
+    },
+}
+
+
+def normalize_name(name):
+    """Match table and column names regardless of schema prefix, quoting, case and '_' or '-'."""
+    return str(name).split('.')[-1].strip('"').replace('_', '-').lower()
+
+
+def get_table_dtypes(table_name=None):
+    """
+    Get the dtype mapping of a table.
+
+    Parameters:
+    table_name (str): Name of the SQLite or PostgreSQL table.
+
+    Returns:
+    dict: Normalized column names mapped to dtypes (None leaves a column unchanged).
+    """
+    dtypes = dict(COLUMN_DTYPES)
+    if table_name is not None:
+        dtypes.update(TABLE_DTYPES.get(normalize_name(table_name), {}))
+    return dtypes
+
+
+def to_integer_dates(series):
+    """
+    Convert dates in YYYYMMDD, ISO or datetime form to YYYYMMDD integers.
+
+    Parameters:
+    series (pd.Series): Date values.
+
+    Returns:
+    pd.Series: int32 dates, or nullable Int32 if some dates could not be parsed.
+    """
+    if pd.api.types.is_integer_dtype(series) or (
+            pd.api.types.is_float_dtype(series) and series.dropna().mod(1).eq(0).all()):
+        # Already YYYYMMDD numbers (floats when read with NULLs), only check the range
+        month, day = series // 100 % 100, series % 100
+        valid = (series.between(10000101, 99991231) & month.between(1, 12) & day.between(1, 31)).fillna(False)
+        integers = series.where(valid)
+        return integers.astype("Int32") if integers.isna().any() else integers.astype("int32")
+    if pd.api.types.is_datetime64_any_dtype(series):
+        dates = series
+    else:
+        text = series.astype(str).str.replace('-', '', regex=False).str[:8]
+        dates = pd.to_datetime(text, format="%Y%m%d", errors="coerce")
+    integers = dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day
+    return integers.astype("Int32") if integers.isna().any() else integers.astype("int32")
+
+
+def apply_table_dtypes(dataframe, table_name=None):
+    """
+    Convert the known columns of a DataFrame to compact dtypes.
+
+    Values that cannot be converted to a numeric dtype become missing values.
+
+    Parameters:
+    dataframe (pd.DataFrame): DataFrame read from the database.
+    table_name (str): Name of the table the DataFrame was read from.
+
+    Returns:
+    pd.DataFrame: DataFrame with converted columns.
+    """
+    dtypes = get_table_dtypes(table_name)
+    for column in dataframe.columns:
+        dtype = dtypes.get(normalize_name(column))
+        if dtype is None or str(dataframe[column].dtype) == dtype:
+            continue
+        if dtype == DATE:
+            dataframe[column] = to_integer_dates(dataframe[column])
+        elif dtype == "category":
+            dataframe[column] = dataframe[column].astype("category")
+        else:
+            numeric = pd.to_numeric(dataframe[column], errors="coerce")
+            try:
+                dataframe[column] = numeric.astype(dtype)
+            except (TypeError, ValueError):
+                dataframe[column] = numeric # Non-integral values in an integer column
+    return dataframe
+
+
+def sqlite_column_types(dataframe, table_name=None):
+    """
+    Choose SQLite column types for a DataFrame from the dtype mapping of its table.
+
+    Columns whose values do not all parse as numbers are stored as TEXT, so
+    no data is lost when the data format changes.
+
+    Parameters:
+    dataframe (pd.DataFrame): DataFrame to insert.
+    table_name (str): Name of the SQL table.
+
+    Returns:
+    dict: Column names mapped to 'INTEGER', 'REAL' or 'TEXT'.
+    """
+    dtypes = get_table_dtypes(table_name)
+    column_types = {}
+    for column in dataframe.columns:
+        dtype = dtypes.get(normalize_name(column)) or ""
+        column_type = "TEXT"
+        if dtype == DATE:
+            if not to_integer_dates(dataframe[column]).isna().gt(dataframe[column].isna()).any():
+                column_type = "INTEGER"
+        elif dtype.lower().startswith(("int", "float")):
+            numeric = pd.to_numeric(dataframe[column], errors="coerce")
+            if not numeric.isna().gt(dataframe[column].isna()).any():
+                integral = numeric.dropna().mod(1).eq(0).all()
+                column_type = "INTEGER" if dtype.lower().startswith("int") and integral else "REAL"
+        column_types[column] = column_type
+    return column_types
+
+
+def prepare_sqlite_records(dataframe, table_name=None):
+    """
+    Convert a DataFrame to the values stored by a typed insert.
+
+    Numbers are kept as float64 and Int64 rather than the compact read dtypes,
+    so stored values are not rounded to float32.
+
+    Parameters:
+    dataframe (pd.DataFrame): DataFrame to insert.
+    table_name (str): Name of the SQL table.
+
+    Returns:
+    tuple: Converted copy of the DataFrame and its SQLite column types.
+    """
+    records = dataframe.copy()
+    dtypes = get_table_dtypes(table_name)
+    column_types = sqlite_column_types(records, table_name)
+    for column, column_type in column_types.items():
+        if column_type == "TEXT":
+            continue
+        if dtypes.get(normalize_name(column)) == DATE:
+            records[column] = to_integer_dates(records[column])
+        else:
+            records[column] = pd.to_numeric(records[column], errors="coerce")
+            if column_type == "INTEGER":
+                records[column] = records[column].astype("Int64")
+    return records, column_types
+
+
+# Example usage:
+# df = apply_table_dtypes(db.read_records("el-metadata"), "el-metadata")
+# df.memory_usage(deep=True)